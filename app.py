@@ -4,316 +4,229 @@
 # - 添加 pdftotext 替代方案 (PyPDF2)
 # - 增强错误处理
 
-import re
-import tempfile
+import os
 import subprocess
+import threading
+import zipfile
+import concurrent.futures
 from pathlib import Path
-from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import io
 
 import streamlit as st
 import pandas as pd
 
+# 解析核心在 parsers.py（纯函数，UI无关），这里只做提取/缓存/渲染
+from parsers import parse_text
+
 # 尝试导入PDF处理库
+# PyMuPDF: 进程内C库提取，免去每个文件~20-50ms的子进程启动开销
+try:
+    import fitz
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+# pypdfium2: PDFium的C封装，作为无子进程环境下的快速备选
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
 try:
     import PyPDF2
     PDF_FALLBACK_AVAILABLE = True
 except ImportError:
     PDF_FALLBACK_AVAILABLE = False
 
+# 尝试导入RapidFuzz（店铺模糊匹配加速）
+try:
+    from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
 st.set_page_config(page_title="PO PDF → CSV (GitHub版)", layout="wide")
 st.title("PO PDF → CSV（GitHub兼容版）")
 
-VENDOR_PROFILES = {
-    "Foodstuffs_NI": {
-        "detect_keywords": ["Foodstuffs North Island Limited", "Order Forecast", "O/F"],
-        "store_regex": r"(?:Delivery\s+To|Delivery\s+Address)[:：]?\s*([^\n]+)",
-        "header_extract": {
-            "PO_Number": r"Order\s+Forecast\s+Number[:：]?\s*([0-9]+)",
-            "Order_Date": r"Date\s+of\s+Order[:：]?\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})",
-            "Delivery_Date": r"Delivery\s+Date[:：]?\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})"
-        }
-    },
-    "WWNZ": {
-        "detect_keywords": ["WOOLWORTHS NZ", "WOOLWORTHS NEW ZEALAND", "PRODUCE ORDER NUMBER", "VENDOR COPY"],
-        "store_regex": r"Deliver\s+To:\s*([0-9]{3,6})\s*\n\s*([^\n]+)",
-        "header_extract": {
-            "PO_Number": r"PRODUCE\s+ORDER\s+NUMBER\s*:\s*([0-9]+)",
-            "Order_Date": r"Order\s+Date\s*:\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})",
-            "Delivery_Date": r"Delivery\s+Date\s*:\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})"
-        }
-    },
-    "MyFoodBag": {
-        "detect_keywords": ["My Food Bag", "My Food Bag Limited", "GST Reg. No:"],
-        "store_regex": r"(My\s*Food\s*Bag[\s\S]{0,200}?Christchurch\s*8042)",
-        "header_extract": {
-            "PO_Number": r"Purchase\s+(?:Order\s+)?No[:：]?\s*([0-9]+)",
-            "Order_Date": r"Order\s*Date[:：]?\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})"
-        }
-    }
-}
-
 # ---------- PDF处理函数 ----------
-def extract_pdf_text(pdf_path: str) -> str:
-    """尝试多种方法提取PDF文本"""
-    
-    # 方法1: 尝试 pdftotext (如果可用)
+def _feed_stdin(stream, data: bytes):
     try:
-        out = subprocess.check_output(
-            ["pdftotext", "-layout", pdf_path, "-"], 
-            stderr=subprocess.STDOUT,
-            timeout=30
-        )
-        text = out.decode("utf-8", errors="ignore")
-        if text.strip():
-            return text
-    except Exception:
+        stream.write(data)
+    except BrokenPipeError:
         pass
-    
-    # 方法2: PyPDF2 备用方案
-    if PDF_FALLBACK_AVAILABLE:
+    finally:
+        stream.close()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def extract_pdf_from_bytes(pdf_bytes: bytes) -> Tuple[str, Optional[str]]:
+    """直接从字节数据提取PDF文本（按字节内容缓存，重跑时不再重新提取）
+
+    返回 (文本, 警告信息)：本函数在工作线程里执行，st.* 没有
+    ScriptRunContext，诊断信息随返回值带回主线程渲染
+    """
+
+    # 方法1: PyMuPDF 进程内提取（最快，无子进程开销）
+    if PYMUPDF_AVAILABLE:
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                if text.strip():
-                    return text
-        except Exception as e:
-            st.warning(f"PyPDF2 提取失败: {e}")
-    
-    return ""
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            text = "\n".join(page.get_text("text") for page in doc)
+            doc.close()
+            if text.strip():
+                return text, None
+        except Exception:
+            pass
 
-def extract_pdf_from_bytes(pdf_bytes: bytes) -> str:
-    """直接从字节数据提取PDF文本"""
-    
-    # 方法1: 保存临时文件用 pdftotext
+    # 方法2: pdftotext 直接从stdin读取字节，无需临时文件；
+    # stdout 边到达边解码，峰值内存只有一份str而不是bytes+str两份
     try:
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-            tmp.write(pdf_bytes)
-            tmp.flush()
-            return extract_pdf_text(tmp.name)
+        p = subprocess.Popen(
+            ["pdftotext", "-layout", "-", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        # 后台线程喂stdin，避免与读stdout互相阻塞；
+        # 定时器给整个读取过程兜底：卡住的pdftotext在30秒后被杀掉，
+        # read() 随之返回，不会无限阻塞也不会泄漏子进程
+        timed_out = threading.Event()
+
+        def _kill_hung():
+            timed_out.set()
+            p.kill()
+
+        killer = threading.Timer(30, _kill_hung)
+        killer.start()
+        feeder = threading.Thread(target=_feed_stdin, args=(p.stdin, pdf_bytes))
+        feeder.start()
+        try:
+            text = io.TextIOWrapper(p.stdout, encoding="utf-8", errors="ignore").read()
+            feeder.join()
+            p.wait()
+        finally:
+            killer.cancel()
+        # 超时杀死后可能拿到半截文本，按失败处理走下一个提取器
+        if not timed_out.is_set() and text.strip():
+            return text, None
     except Exception:
         pass
-    
-    # 方法2: PyPDF2 直接处理字节流
+
+    # 方法3: pypdfium2 进程内提取
+    if PDFIUM_AVAILABLE:
+        try:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            text = "\n".join(page.get_textpage().get_text_bounded() for page in pdf)
+            pdf.close()
+            if text.strip():
+                return text, None
+        except Exception:
+            pass
+
+    # 方法4: PyPDF2 直接处理字节流
     if PDF_FALLBACK_AVAILABLE:
         try:
             pdf_stream = io.BytesIO(pdf_bytes)
             pdf_reader = PyPDF2.PdfReader(pdf_stream)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+            # 逐页惰性提取 + 单次join，避免 += 的平方级字符串重分配
+            return "\n".join(page.extract_text() or "" for page in pdf_reader.pages), None
         except Exception as e:
-            st.warning(f"PyPDF2 字节流处理失败: {e}")
-    
-    return ""
+            return "", f"PyPDF2 字节流处理失败: {e}"
 
-# ---------- 辅助函数 ----------
-def parse_date_safe(s: str) -> Optional[str]:
-    if not s:
-        return None
-    for fmt in ("%d/%m/%Y", "%d/%m/%y", "%Y/%m/%d", "%d-%m-%Y", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(s.strip(), fmt).date().isoformat()
-        except Exception:
-            continue
-    return s
-
-def extract(pattern: str, text: str, flags=re.I|re.S) -> Optional[str]:
-    if not pattern or not text:
-        return None
-    m = re.search(pattern, text, flags=flags)
-    if not m:
-        return None
-    return m.group(1).strip() if m.lastindex else m.group(0).strip()
-
-def detect_vendor(text_concat: str) -> Optional[str]:
-    if not text_concat:
-        return None
-    
-    t = text_concat.upper()
-    # prefer WWNZ first
-    if any(kw in t for kw in [k.upper() for k in VENDOR_PROFILES["WWNZ"]["detect_keywords"]]):
-        return "WWNZ"
-    for v in ("Foodstuffs_NI","MyFoodBag"):
-        if any(kw.upper() in t for kw in VENDOR_PROFILES[v]["detect_keywords"]):
-            return v
-    return None
-
-def keyword_hits(text: str) -> Dict[str, int]:
-    text_u = (text or '').upper()
-    def count(keys):
-        return sum(text_u.count(k.upper()) for k in keys)
-    return {
-        'Foodstuffs_NI': count(VENDOR_PROFILES['Foodstuffs_NI']['detect_keywords']),
-        'WWNZ': count(VENDOR_PROFILES['WWNZ']['detect_keywords']),
-        'MyFoodBag': count(VENDOR_PROFILES['MyFoodBag']['detect_keywords'])
-    }
-
-def normalize_numeric(series):
-    if series is None or len(series) == 0:
-        return pd.Series(dtype=float)
-    
-    s = pd.Series(series)
-    s = s.apply(lambda x: (x[0] if isinstance(x, (list, tuple)) and len(x)>0 else x))
-    s = s.astype(str).str.replace(r"[\s,\$]", "", regex=True)
-    s = s.str.extract(r"(-?\d+(?:\.\d+)?)", expand=False)
-    return pd.to_numeric(s, errors="coerce")
-
-def clean_store_name(vendor: str, raw_name: Optional[str]) -> Optional[str]:
-    """清理店铺名称"""
-    if not raw_name:
-        return raw_name
-        
-    if vendor == "WWNZ":
-        # 移除供应商编号等额外文本
-        cleaned = re.sub(r'\d{4}-?\s*-?\s*Vendor\s*Number:?\s*\d+', '', raw_name)
-        cleaned = re.sub(r'^\d{3,5}\s*\n?\s*', '', cleaned)
-        return cleaned.strip()
-    
-    return raw_name.strip() if raw_name else raw_name
+    return "", None
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _csv_bytes(df: pd.DataFrame) -> bytes:
+    """DataFrame → utf-8-sig CSV 字节：直接写 BytesIO，免去整串str物化后再encode的第二次拷贝；
+    按帧内容缓存，widget交互触发的rerun不再重新序列化 N+1 份CSV"""
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8-sig")
+    return buf.getvalue()
+
+# ---------- 店铺映射查找 ----------
+def _store_map_cache(store_map_df: pd.DataFrame):
+    """把店铺映射表展开成 (原始名, 小写名, id) 列表并缓存在 session_state，每次上传只建一次"""
+    try:
+        cached = st.session_state.get("_store_map_cache")
+        if cached is not None and cached[0] is store_map_df:
+            return cached[1]
+    except Exception:
+        pass
+
+    cols = {c.strip().lower(): c for c in store_map_df.columns}
+    names_s = store_map_df[cols["name"]].astype(str)
+    names = names_s.tolist()
+    ids = store_map_df[cols["store_id"]].tolist()
+    # strip/lower 走 pandas 的 C 级 str 管线，而不是逐元素的 Python 循环；
+    # Series 形式同时供回退路径做向量化的字面量子串匹配
+    names_lower_s = names_s.str.strip().str.lower().reset_index(drop=True)
+    names_lower = names_lower_s.tolist()
+    # 规范化名 -> 行号 的精确索引，重复键保留首个（与扫描语义一致）
+    exact = {}
+    for i, low in enumerate(names_lower):
+        exact.setdefault(low, i)
+        exact.setdefault(low[:40], i)
+    entry = (names, names_lower, names_lower_s, ids, exact)
+    try:
+        st.session_state["_store_map_cache"] = (store_map_df, entry)
+    except Exception:
+        pass
+    return entry
 
 def store_lookup(name_text: str, store_map_df: Optional[pd.DataFrame]):
     """查找店铺ID"""
     if store_map_df is None or not name_text:
         return None, None
-    
+
     try:
-        df = store_map_df.copy()
-        df.columns = [c.strip().lower() for c in df.columns]
+        names, names_lower, names_lower_s, ids, exact = _store_map_cache(store_map_df)
         key = str(name_text).strip().lower()
-        
-        # 正向包含匹配
-        m = df[df.get("name","").astype(str).str.lower().str.contains(re.escape(key[:40]), na=False)]
-        if not m.empty:
-            return m.iloc[0].get("store_id"), m.iloc[0].get("name")
-        
-        # 反向包含匹配
-        m = df[df.get("name","").astype(str).str.lower().apply(lambda x: key in x if x else False)]
-        if not m.empty:
-            return m.iloc[0].get("store_id"), m.iloc[0].get("name")
-        
+
+        # O(1) 精确命中优先，完全匹配的店名不用进任何扫描
+        idx = exact.get(key)
+        if idx is None:
+            idx = exact.get(key[:40])
+        if idx is not None:
+            return ids[idx], names[idx]
+
+        # RapidFuzz：C实现的模糊匹配，一次调用代替逐行扫描
+        if RAPIDFUZZ_AVAILABLE:
+            best = rf_process.extractOne(
+                key, names_lower, scorer=rf_fuzz.partial_ratio, score_cutoff=80
+            )
+            if best is not None:
+                idx = best[2]
+                return ids[idx], names[idx]
+            return None, None
+
+        # 回退：正向包含走C级字面量子串匹配（regex=False），
+        # 反向包含（店名出现在key里）没有向量化等价，才逐个检查
+        key_head = key[:40]
+        mask = names_lower_s.str.contains(key_head, regex=False, na=False)
+        hits = mask[mask].index
+        if len(hits):
+            idx = hits[0]
+            return ids[idx], names[idx]
+        for idx, low in enumerate(names_lower):
+            if low and low in key:
+                return ids[idx], names[idx]
         return None, None
     except Exception as e:
         st.warning(f"店铺查找错误: {e}")
         return None, None
 
-# ---------- 供应商解析器 ----------
-def parse_foodstuffs(text: str) -> pd.DataFrame:
-    """解析 Foodstuffs PDF"""
-    pat = re.compile(
-        r"^\s*\d+\s+(?P<article>\d{6,})\s+[A-Z0-9$]+\s+.+?\s+(?P<qty>\d+)\s+[A-Z]{2,4}\s+\d+\s+\$?(?P<price>[\d,]+\.\d{2}).*?\$?[\d,]+\.\d{2}\s*$",
-        re.I
-    )
-    rows = []
-    for ln in text.splitlines():
-        m = pat.match(ln)
-        if m:
-            rows.append({
-                "item_id": m.group("article"),
-                "quantity": m.group("qty"),
-                "price": m.group("price").replace(',', ''),
-            })
-    return pd.DataFrame(rows)
-
-def parse_wwnz(text: str) -> pd.DataFrame:
-    """解析 WWNZ PDF - 修复价格提取"""
-    rows = []
-    lines = text.splitlines()
-    
-    # 查找数据部分
-    data_started = False
-    for ln in lines:
-        # 查找表头
-        if re.search(r'LINE.*ITEM NO.*ORD QTY.*PRICE', ln, re.I):
-            data_started = True
-            continue
-            
-        if not data_started:
-            continue
-            
-        # 遇到总计时停止
-        if re.search(r'Order Totals|Total Value', ln, re.I):
-            break
-            
-        # 解析数据行 - 更灵活的模式
-        match = re.match(r'^\s*(\d+)\s+(\d{8,14})\s+(.*?)\s+(\d{5,})\s+([\d.]+)\s+(\S+)\s+(\d+)\s+(\d+)\s+([\d.]+)', ln.strip())
-        
-        if match:
-            line_no, gtin, desc, item_no, tu, sfx, om, qty, price = match.groups()
-            rows.append({
-                "item_id": item_no,
-                "quantity": qty,
-                "price": price,
-            })
-    
-    return pd.DataFrame(rows)
+# ---------- 解析入口 ----------
+@st.cache_data(max_entries=64, show_spinner=False)
+def parse_pdf(text: str, vendor_choice: str) -> Dict[str, Any]:
+    """parse_text 的缓存包装：按 (文本, 供应商选择) 缓存；切换侧栏选项不会触发重新解析"""
+    return parse_text(text, vendor_choice)
 
-def parse_mfb(text: str) -> pd.DataFrame:
-    """解析 MyFoodBag PDF - 修复数量提取"""
-    rows = []
-    lines = [ln.rstrip() for ln in text.splitlines() if ln.strip()]
-    
-    # 查找包含 Item No, QTY 等的表头
-    header_found = False
-    for i, ln in enumerate(lines):
-        if re.search(r'item\s*no.*qty.*description', ln, re.I):
-            header_found = True
-            # 从下一行开始处理数据
-            for data_line in lines[i+1:]:
-                # 遇到总计或结束标记时停止
-                if re.search(r'\btotal\b|balance\s+due|page\s+\d+', data_line, re.I):
-                    break
-                
-                # 查找以物品编号开头的行 (MFB 格式为 10xxxxxxx)
-                if re.match(r'^\s*10\d{6,}', data_line):
-                    # 仔细分割行
-                    parts = re.split(r'\s{2,}', data_line.strip())
-                    
-                    if len(parts) >= 5:  # Item No, QTY, Description, Date, Price, [Total]
-                        item_no = parts[0].strip()
-                        qty = parts[1].strip()
-                        price = parts[4].strip() if len(parts) > 4 else parts[-2].strip()
-                        
-                        # 清理数值
-                        qty = re.sub(r'[^\d.]', '', qty)
-                        price = re.sub(r'[^\d.]', '', price)
-                        
-                        if qty and price and item_no:
-                            rows.append({
-                                "item_id": item_no,
-                                "quantity": qty,
-                                "price": price
-                            })
-            break
-    
-    return pd.DataFrame(rows)
-
-def validate_dataframe(df: pd.DataFrame, vendor_name: str) -> pd.DataFrame:
-    """验证和清理解析后的数据框"""
-    if df.empty:
-        return df
-    
-    # 移除完全空的行
-    df = df.dropna(how='all')
-    
-    # 移除没有 item_id 的行
-    df = df[df['item_id'].notna() & (df['item_id'] != '')]
-    
-    # 确保数字列格式正确
-    if 'quantity' in df.columns:
-        df['quantity'] = normalize_numeric(df['quantity'])
-    if 'price' in df.columns:
-        df['price'] = normalize_numeric(df['price'])
-    
-    # 移除无效数据的行
-    df = df[(df.get('quantity', 0) > 0) & (df.get('price', 0) > 0)]
-    
-    return df.reset_index(drop=True)
+def process_one(file_bytes: bytes, vendor_choice: str) -> Dict[str, Any]:
+    """单个PDF的完整流水线（提取文本+识别+解析），可整体放进工作线程执行"""
+    text, warning = extract_pdf_from_bytes(file_bytes)
+    if not text or not text.strip():
+        return {"text": "", "parsed": None, "warning": warning}
+    return {"text": text, "parsed": parse_pdf(text, vendor_choice), "warning": warning}
 
 # ---------- Streamlit 界面 ----------
 with st.sidebar:
@@ -338,6 +251,7 @@ with st.sidebar:
                 st.error(f"store_map.csv 缺少必需列: {missing_cols}")
                 store_map_df = None
             else:
+                _store_map_cache(store_map_df)  # 预热查找缓存
                 st.success(f"✅ 已加载门店映射，共 {len(store_map_df)} 条记录")
         except Exception as e:
             st.error(f"store_map 读取失败：{e}")
@@ -346,65 +260,41 @@ uploaded = st.file_uploader("上传一个或多个 PO PDF", type=["pdf"], accept
 
 # ---------- 主处理逻辑 ----------
 results = []
+csv_files = []
 if uploaded:
     progress_bar = st.progress(0)
-    
-    for idx, f in enumerate(uploaded):
+
+    # 每个文件的整条流水线（提取+识别+解析）并行执行：提取端的子进程/C库
+    # 不占GIL，总耗时从"各文件之和"降到"最慢文件"；st.* 渲染留在主线程
+    workers = min(len(uploaded), os.cpu_count() or 4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+        processed = list(ex.map(lambda f: process_one(f.read(), vendor_choice), uploaded))
+
+    for idx, (f, result) in enumerate(zip(uploaded, processed)):
         progress_bar.progress((idx + 1) / len(uploaded))
-        
-        # 提取PDF文本
-        text = extract_pdf_from_bytes(f.read())
-        
-        if not text or not text.strip():
+
+        if not result["text"]:
+            if result.get("warning"):
+                st.warning(f"⚠️ {f.name}: {result['warning']}")
             st.error(f"❌ {f.name}: PDF 文本提取失败（可能是扫描版或加密的PDF）")
             continue
 
-        # 供应商识别
-        hits = keyword_hits(text)
-        active_vendor = detect_vendor(text) if vendor_choice == "Auto" else vendor_choice
-
-        # 自动回退：尝试所有解析器并选择结果最多的
-        body = None
-        chosen_by_rows = None
-        if active_vendor is None and vendor_choice == "Auto":
-            fs_df = validate_dataframe(parse_foodstuffs(text), "Foodstuffs_NI")
-            ww_df = validate_dataframe(parse_wwnz(text), "WWNZ")
-            mfb_df = validate_dataframe(parse_mfb(text), "MyFoodBag")
-            
-            sizes = {'Foodstuffs_NI': len(fs_df), 'WWNZ': len(ww_df), 'MyFoodBag': len(mfb_df)}
-            if any(sizes.values()):
-                chosen_by_rows = max(sizes, key=lambda k: sizes[k])
-                active_vendor = chosen_by_rows
-                body = {'Foodstuffs_NI': fs_df, 'WWNZ': ww_df, 'MyFoodBag': mfb_df}[chosen_by_rows]
-
-        if active_vendor is None:
-            st.error(f"❌ {f.name}: 未识别供应商（关键词命中：{hits}）。请在左侧手动选择供应商。")
+        parsed = result["parsed"]
+
+        if parsed["vendor"] is None:
+            st.error(f"❌ {f.name}: 未识别供应商（关键词命中：{parsed['hits']}）。请在左侧手动选择供应商。")
             continue
 
-        # 提取头部信息
-        prof = VENDOR_PROFILES[active_vendor]
-        sales_id = extract(prof["header_extract"].get("PO_Number"), text)
-        order_date = extract(prof["header_extract"].get("Delivery_Date") or prof["header_extract"].get("Order_Date"), text)
-        order_date = parse_date_safe(order_date)
-        
-        # 提取并清理店铺名称
-        raw_name = extract(prof["store_regex"], text)
-        name_txt = clean_store_name(active_vendor, raw_name)
-
-        # 解析供应商数据（如果尚未完成）
-        if body is None:
-            try:
-                if active_vendor == "Foodstuffs_NI":
-                    body = parse_foodstuffs(text)
-                elif active_vendor == "WWNZ":
-                    body = parse_wwnz(text)
-                else:
-                    body = parse_mfb(text)
-                
-                body = validate_dataframe(body, active_vendor)
-            except Exception as e:
-                st.error(f"❌ {f.name}: 解析失败 - {e}")
-                continue
+        if parsed.get("error"):
+            st.error(f"❌ {f.name}: 解析失败 - {parsed['error']}")
+            continue
+
+        active_vendor = parsed["vendor"]
+        body = parsed["body"]
+        sales_id = parsed["sales_id"]
+        order_date = parsed["order_date"]
+        name_txt = parsed["name"]
+        chosen_by_rows = parsed["chosen_by_rows"]
 
         if body.empty:
             st.warning(f"⚠️ {f.name}: 未解析到任何产品数据")
@@ -414,16 +304,13 @@ if uploaded:
         store_id, mapped_name = store_lookup(name_txt, store_map_df)
         final_name = mapped_name or name_txt
 
-        # 创建输出数据框
-        out = pd.DataFrame({
-            "store_id": store_id,
-            "name": final_name,
-            "sales_id": sales_id,
-            "order_date": order_date,
-            "item_id": body.get("item_id"),
-            "quantity": body.get("quantity"),
-            "price": body.get("price")
-        })
+        # 创建输出数据框：头部字段以标量广播进已有body，避免重新构建各列
+        out = body.assign(
+            store_id=store_id,
+            name=final_name,
+            sales_id=sales_id,
+            order_date=order_date
+        )[["store_id", "name", "sales_id", "order_date", "item_id", "quantity", "price"]]
 
         # 最终清理 - 移除剩余的空行
         out = out.dropna(subset=['item_id'])
@@ -446,36 +333,51 @@ if uploaded:
         
         st.markdown(info)
         st.dataframe(out, use_container_width=True)
-        
-        # 下载单个文件
-        csv_data = out.to_csv(index=False).encode("utf-8-sig")
-        st.download_button(
-            label=f"⬇️ 下载 {Path(f.name).stem}.csv",
-            data=csv_data,
-            file_name=f"{Path(f.name).stem}.csv",
-            mime="text/csv",
-            key=f"dl_{f.name}"
-        )
 
+        # 单文件CSV先收集，循环结束后统一提供下载（避免每个文件注册一个按钮，
+        # 任何按钮点击触发的rerun都要重渲染全部N个widget）
+        csv_files.append((f"{Path(f.name).stem}.csv", _csv_bytes(out)))
         results.append(out)
 
     # 合并所有结果
     if results:
-        merged = pd.concat(results, ignore_index=True)
+        # 各分块schema一致，copy=False让concat做近零拷贝的纵向堆叠
+        merged = pd.concat(results, ignore_index=True, copy=False)
         # 最终清理合并数据
         merged = merged.dropna(subset=['item_id'])
         merged = merged[merged['item_id'] != '']
+
+        # 表头列每个文件内恒定、跨文件低基数，转 category 去重字符串，
+        # 大批量合并时显著压缩内存
+        for c in ("store_id", "name", "sales_id", "order_date"):
+            if c in merged.columns:
+                merged[c] = merged[c].astype("category")
         
         st.markdown("---")
         total_value = merged['price'].sum() if 'price' in merged.columns else 0
         st.markdown(f"**📊 合并统计**: {len(merged)} 项产品，总值 ${total_value:.2f}")
-        
-        st.download_button(
-            "⬇️ 下载合并 CSV（orders.csv）",
-            merged.to_csv(index=False).encode("utf-8-sig"),
-            file_name="orders.csv",
-            mime="text/csv"
-        )
+
+        # 单文件CSV打包成一个zip：N个下载按钮变成1个
+        zip_buf = io.BytesIO()
+        with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as z:
+            for csv_name, csv_data in csv_files:
+                z.writestr(csv_name, csv_data)
+
+        col_zip, col_csv = st.columns(2)
+        with col_zip:
+            st.download_button(
+                "⬇️ 下载各文件 CSV（orders_csv.zip）",
+                zip_buf.getvalue(),
+                file_name="orders_csv.zip",
+                mime="application/zip"
+            )
+        with col_csv:
+            st.download_button(
+                "⬇️ 下载合并 CSV（orders.csv）",
+                _csv_bytes(merged),
+                file_name="orders.csv",
+                mime="text/csv"
+            )
     
     progress_bar.empty()
 else:
@@ -0,0 +1,390 @@
+# parsers.py – PO PDF 文本解析核心（供应商识别/表头提取/行解析/数值清洗）
+# 与 Streamlit 无关的纯函数集中在这里，便于缓存包装、线程池调用和单独测试
+
+import re
+import functools
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple
+
+import pandas as pd
+
+VENDOR_PROFILES = {
+    "Foodstuffs_NI": {
+        "detect_keywords": ["Foodstuffs North Island Limited", "Order Forecast", "O/F"],
+        "store_regex": r"(?:Delivery\s+To|Delivery\s+Address)[:：]?\s*([^\n]+)",
+        "header_extract": {
+            "PO_Number": r"Order\s+Forecast\s+Number[:：]?\s*([0-9]+)",
+            "Order_Date": r"Date\s+of\s+Order[:：]?\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})",
+            "Delivery_Date": r"Delivery\s+Date[:：]?\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})"
+        }
+    },
+    "WWNZ": {
+        "detect_keywords": ["WOOLWORTHS NZ", "WOOLWORTHS NEW ZEALAND", "PRODUCE ORDER NUMBER", "VENDOR COPY"],
+        "store_regex": r"Deliver\s+To:\s*([0-9]{3,6})\s*\n\s*([^\n]+)",
+        "header_extract": {
+            "PO_Number": r"PRODUCE\s+ORDER\s+NUMBER\s*:\s*([0-9]+)",
+            "Order_Date": r"Order\s+Date\s*:\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})",
+            "Delivery_Date": r"Delivery\s+Date\s*:\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})"
+        }
+    },
+    "MyFoodBag": {
+        "detect_keywords": ["My Food Bag", "My Food Bag Limited", "GST Reg. No:"],
+        "store_regex": r"(My\s*Food\s*Bag[\s\S]{0,200}?Christchurch\s*8042)",
+        "header_extract": {
+            "PO_Number": r"Purchase\s+(?:Order\s+)?No[:：]?\s*([0-9]+)",
+            "Order_Date": r"Order\s*Date[:：]?\s*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})"
+        }
+    }
+}
+
+def _compile_profiles():
+    """导入时把 VENDOR_PROFILES 里的字符串正则编译成 re.Pattern，避免每个PDF重复查 re._compile 缓存"""
+    for prof in VENDOR_PROFILES.values():
+        # 每个表头模式的起始字面量（如 "produce"/"purchase"）：全文回退扫描前
+        # 先做廉价的子串预筛，字面量都不在文本里就根本不进正则引擎
+        literals = {}
+        for key, pat in prof["header_extract"].items():
+            m = re.match(r"[A-Za-z]+", pat)
+            if m:
+                literals[key] = m.group(0).lower()
+        prof["_header_literals"] = literals
+        prof["store_regex"] = re.compile(prof["store_regex"], re.I | re.S)
+        prof["header_extract"] = {
+            key: re.compile(pat, re.I | re.S)
+            for key, pat in prof["header_extract"].items()
+        }
+
+_compile_profiles()
+
+# ---------- 辅助函数 ----------
+@functools.lru_cache(maxsize=512)
+def parse_date_safe(s: str) -> Optional[str]:
+    # 同一批PO里订单/交货日期高度重复，缓存省掉反复的strptime试错
+    if not s:
+        return None
+    for fmt in ("%d/%m/%Y", "%d/%m/%y", "%Y/%m/%d", "%d-%m-%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(s.strip(), fmt).date().isoformat()
+        except Exception:
+            continue
+    return s
+
+def extract(pattern: Optional[re.Pattern], text: str) -> Optional[str]:
+    if pattern is None or not text:
+        return None
+    m = pattern.search(text)
+    if not m:
+        return None
+    return m.group(1).strip() if m.lastindex else m.group(0).strip()
+
+# 所有供应商关键词合并为一个 alternation，一趟 finditer 同时得到
+# 命中计数和供应商判定（多模式匹配，避免逐供应商逐关键词重复扫描）。
+# 每个供应商一个命名分组：命中归属直接读 m.lastgroup，全程零大小写折叠拷贝
+_VENDOR_PRIORITY = ("WWNZ", "Foodstuffs_NI", "MyFoodBag")  # prefer WWNZ first
+_KEYWORD_SCAN = re.compile(
+    "|".join(
+        "(?P<%s>%s)" % (
+            vendor,
+            "|".join(
+                re.escape(kw)
+                for kw in sorted(VENDOR_PROFILES[vendor]["detect_keywords"], key=len, reverse=True)
+            ),
+        )
+        for vendor in _VENDOR_PRIORITY
+    ),
+    re.I
+)
+
+# 供应商标识几乎总在首页页眉，先扫这么多字节，扫不到再回退全文
+_DETECT_PREFIX = 4096
+
+def _tally_keywords(text: str) -> Tuple[Optional[str], Dict[str, int]]:
+    counts = dict.fromkeys(_VENDOR_PRIORITY, 0)
+    for m in _KEYWORD_SCAN.finditer(text):
+        counts[m.lastgroup] += 1
+    vendor = next((v for v in _VENDOR_PRIORITY if counts[v]), None)
+    return vendor, counts
+
+def scan_vendor_keywords(text: str) -> Tuple[Optional[str], Dict[str, int]]:
+    """扫描文本返回 (识别的供应商, 各供应商关键词命中计数)，优先只看文档开头"""
+    if not text:
+        return None, dict.fromkeys(_VENDOR_PRIORITY, 0)
+    vendor, counts = _tally_keywords(text[:_DETECT_PREFIX])
+    if vendor is not None or len(text) <= _DETECT_PREFIX:
+        return vendor, counts
+    return _tally_keywords(text)
+
+_NUM_EXTRACT = re.compile(r"(-?\d+(?:\.\d+)?)")
+
+def normalize_numeric(series):
+    if series is None or len(series) == 0:
+        return pd.Series(dtype=float)
+
+    s = pd.Series(series)
+    # 快路径：解析器产出的通常已是干净的数字字符串，直接转换即可，
+    # 失败时才回退到完整的正则清洗
+    try:
+        return pd.to_numeric(s)
+    except (ValueError, TypeError):
+        pass
+
+    # 列表/元组单元只在脏输入里偶尔出现：用布尔掩码圈出来单独解包，
+    # 标量单元不经过任何逐元素回调
+    if s.dtype == object:
+        mask = s.map(lambda x: isinstance(x, (list, tuple)))
+        if mask.any():
+            s = s.copy()
+            s[mask] = s[mask].map(lambda x: x[0] if len(x) > 0 else None)
+    # 千分位逗号用字面量替换剥掉（C级子串替换，不进正则引擎），
+    # $/空白交给 extract 自然跳过：全程只剩一次正则扫描
+    s = s.astype(str).str.replace(",", "", regex=False)
+    s = s.str.extract(_NUM_EXTRACT, expand=False)
+    return pd.to_numeric(s, errors="coerce")
+
+_WWNZ_VENDOR_NO = re.compile(r'\d{4}-?\s*-?\s*Vendor\s*Number:?\s*\d+')
+_WWNZ_STORE_CODE = re.compile(r'^\d{3,5}\s*\n?\s*')
+
+def clean_store_name(vendor: str, raw_name: Optional[str]) -> Optional[str]:
+    """清理店铺名称"""
+    if not raw_name:
+        return raw_name
+
+    if vendor == "WWNZ":
+        # 移除供应商编号等额外文本
+        cleaned = _WWNZ_VENDOR_NO.sub('', raw_name)
+        cleaned = _WWNZ_STORE_CODE.sub('', cleaned)
+        return cleaned.strip()
+
+    return raw_name.strip() if raw_name else raw_name
+
+# ---------- 供应商解析器 ----------
+# 行级正则统一在模块级编译一次，而不是每次调用解析函数时重建
+# 捕获到 price 即止：不再用 `.*?` 去消费行尾的合计金额，避免懒惰量词
+# 在不匹配的长行上产生近似平方级的回溯
+_FOODSTUFFS_LINE = re.compile(
+    r"^[ \t]*\d+[ \t]+(?P<article>\d{6,})[ \t]+[A-Z0-9$]+[ \t]+[^\n]+?[ \t]+(?P<qty>\d+)[ \t]+[A-Z]{2,4}[ \t]+\d+[ \t]+\$?(?P<price>[\d,]+\.\d{2})",
+    re.I | re.M
+)
+_WWNZ_HEADER = re.compile(r'LINE.*ITEM NO.*ORD QTY.*PRICE', re.I)
+_WWNZ_TOTALS = re.compile(r'Order Totals|Total Value', re.I)
+_WWNZ_LINE = re.compile(
+    r'^[ \t]*(\d+)[ \t]+(\d{8,14})[ \t]+([^\n]*?)[ \t]+(\d{5,})[ \t]+([\d.]+)[ \t]+(\S+)[ \t]+(\d+)[ \t]+(\d+)[ \t]+([\d.]+)',
+    re.M
+)
+_MFB_HEADER = re.compile(r'item\s*no.*qty.*description', re.I)
+_MFB_STOP = re.compile(r'\btotal\b|balance\s+due|page\s+\d+', re.I)
+# 一行 = 物品编号(10xxxxxxx)、数量、描述、日期、单价，两个以上空格分列；
+# 数量/单价按数字形状捕获，但容忍真实单据里的修饰：数量后的单位
+# 后缀（"24 ea"）和单价前的货币符号（"$45.00"）
+_MFB_LINE = re.compile(
+    r'^[ \t]*(?P<item>10\d{6,})[ \t]{2,}(?P<qty>\d+(?:\.\d+)?)(?:[ \t]?[A-Za-z]+)?[ \t]{2,}[^\n]+?[ \t]{2,}\S+[ \t]{2,}\$?(?P<price>[\d,]+(?:\.\d+)?)',
+    re.M
+)
+
+# 自动回退用的合并正则：三个供应商的行模式作为命名分支合成一个 pattern，
+# 对全文扫描一次即可得到各供应商的候选行，代替三次独立全文扫描
+_ANY_VENDOR_LINE = re.compile(
+    r"(?P<fs>(?i:^[ \t]*\d+[ \t]+(?P<fs_item>\d{6,})[ \t]+[A-Z0-9$]+[ \t]+[^\n]+?[ \t]+(?P<fs_qty>\d+)[ \t]+[A-Z]{2,4}[ \t]+\d+[ \t]+\$?(?P<fs_price>[\d,]+\.\d{2})))"
+    r"|(?P<ww>^[ \t]*\d+[ \t]+\d{8,14}[ \t]+[^\n]*?[ \t]+(?P<ww_item>\d{5,})[ \t]+[\d.]+[ \t]+\S+[ \t]+\d+[ \t]+(?P<ww_qty>\d+)[ \t]+(?P<ww_price>[\d.]+))"
+    r"|(?P<mfb>^[ \t]*(?P<mfb_item>10\d{6,})[ \t]{2,}(?P<mfb_qty>\d+(?:\.\d+)?)(?:[ \t]?[A-Za-z]+)?[ \t]{2,}[^\n]+?[ \t]{2,}\S+[ \t]{2,}\$?(?P<mfb_price>[\d,]+(?:\.\d+)?))",
+    re.M
+)
+
+def _parse_all_vendors(text: str) -> Dict[str, pd.DataFrame]:
+    """自动回退：单次合并扫描产出三个供应商的候选行（代替逐供应商重扫全文）"""
+    # WWNZ/MFB 的有效区间（表头之后、总计之前）与各自解析器保持一致
+    ww_lo = ww_hi = -1
+    header = _WWNZ_HEADER.search(text)
+    if header:
+        ww_lo, ww_hi = header.end(), len(text)
+        totals = _WWNZ_TOTALS.search(text, ww_lo)
+        if totals:
+            ww_hi = totals.start()
+
+    mfb_lo = mfb_hi = -1
+    header = _MFB_HEADER.search(text)
+    if header:
+        start = text.find("\n", header.end()) + 1
+        if start:
+            mfb_lo, mfb_hi = start, len(text)
+            stop = _MFB_STOP.search(text, start)
+            if stop:
+                mfb_hi = stop.start()
+
+    # 顺序与原先逐供应商解析时一致，保证行数并列时的选择不变
+    columns = {v: ([], [], []) for v in ("Foodstuffs_NI", "WWNZ", "MyFoodBag")}
+    for m in _ANY_VENDOR_LINE.finditer(text):
+        if m.group("fs") is not None:
+            item_ids, qtys, prices = columns["Foodstuffs_NI"]
+            item_ids.append(m.group("fs_item"))
+            qtys.append(m.group("fs_qty"))
+            prices.append(m.group("fs_price").replace(',', ''))
+        elif m.group("ww") is not None:
+            if ww_lo <= m.start() < ww_hi:
+                item_ids, qtys, prices = columns["WWNZ"]
+                item_ids.append(m.group("ww_item"))
+                qtys.append(m.group("ww_qty"))
+                prices.append(m.group("ww_price"))
+        else:
+            if mfb_lo <= m.start() < mfb_hi:
+                item_ids, qtys, prices = columns["MyFoodBag"]
+                item_ids.append(m.group("mfb_item"))
+                qtys.append(m.group("mfb_qty"))
+                prices.append(m.group("mfb_price").replace(',', ''))
+
+    return {
+        vendor: pd.DataFrame({"item_id": cols[0], "quantity": cols[1], "price": cols[2]})
+        for vendor, cols in columns.items()
+    }
+
+def parse_foodstuffs(text: str) -> pd.DataFrame:
+    """解析 Foodstuffs PDF"""
+    # 单次 MULTILINE finditer 扫描全文，避免逐行跨越解释器边界
+    # 三个平行列表直接构造列（SoA），避免每行一个小字典的键哈希开销
+    item_ids, qtys, prices = [], [], []
+    for m in _FOODSTUFFS_LINE.finditer(text):
+        item_ids.append(m.group("article"))
+        qtys.append(m.group("qty"))
+        prices.append(m.group("price").replace(',', ''))
+    return pd.DataFrame({"item_id": item_ids, "quantity": qtys, "price": prices})
+
+def parse_wwnz(text: str) -> pd.DataFrame:
+    """解析 WWNZ PDF - 修复价格提取"""
+    # 先定位数据区间（表头之后、总计之前），再对区间做单次 MULTILINE 扫描
+    header = _WWNZ_HEADER.search(text)
+    if not header:
+        return pd.DataFrame()
+    body = text[header.end():]
+    totals = _WWNZ_TOTALS.search(body)
+    if totals:
+        body = body[:totals.start()]
+
+    # 解析数据行 - 更灵活的模式
+    item_ids, qtys, prices = [], [], []
+    for m in _WWNZ_LINE.finditer(body):
+        item_ids.append(m.group(4))
+        qtys.append(m.group(8))
+        prices.append(m.group(9))
+    return pd.DataFrame({"item_id": item_ids, "quantity": qtys, "price": prices})
+
+def parse_mfb(text: str) -> pd.DataFrame:
+    """解析 MyFoodBag PDF - 修复数量提取"""
+    item_ids, qtys, prices = [], [], []
+
+    # 定位表头行，截取到总计/分页标记为止，再做单次 MULTILINE 扫描
+    # （代替原来的表头循环 + 逐行 match + re.split 三层Python遍历）
+    header = _MFB_HEADER.search(text)
+    if header:
+        start = text.find("\n", header.end()) + 1
+        body = text[start:] if start else ""
+        stop = _MFB_STOP.search(body)
+        if stop:
+            body = body[:stop.start()]
+
+        for m in _MFB_LINE.finditer(body):
+            item_ids.append(m.group('item'))
+            qtys.append(m.group('qty'))
+            prices.append(m.group('price').replace(',', ''))
+
+    return pd.DataFrame({"item_id": item_ids, "quantity": qtys, "price": prices})
+
+def validate_dataframe(df: pd.DataFrame, vendor_name: str) -> pd.DataFrame:
+    """验证和清理解析后的数据框"""
+    if df.empty:
+        return df
+
+    # 移除完全空的行
+    df = df.dropna(how='all')
+
+    # 移除没有 item_id 的行
+    df = df[df['item_id'].notna() & (df['item_id'] != '')]
+
+    # 确保数字列格式正确
+    if 'quantity' in df.columns:
+        df['quantity'] = normalize_numeric(df['quantity'])
+    if 'price' in df.columns:
+        df['price'] = normalize_numeric(df['price'])
+
+    # 移除无效数据的行
+    df = df[(df.get('quantity', 0) > 0) & (df.get('price', 0) > 0)]
+
+    return df.reset_index(drop=True)
+
+def parse_text(text: str, vendor_choice: str) -> Dict[str, Any]:
+    """解析单个PDF文本：识别供应商、提取表头、解析行项目（纯函数，UI端负责缓存）"""
+    detected, hits = scan_vendor_keywords(text)
+    active_vendor = detected if vendor_choice == "Auto" else vendor_choice
+
+    # 自动回退：一次合并扫描产出各供应商候选行，选结果最多的
+    body = None
+    chosen_by_rows = None
+    if active_vendor is None and vendor_choice == "Auto":
+        candidates = {
+            vendor: validate_dataframe(df, vendor)
+            for vendor, df in _parse_all_vendors(text).items()
+        }
+        sizes = {vendor: len(df) for vendor, df in candidates.items()}
+        if any(sizes.values()):
+            chosen_by_rows = max(sizes, key=lambda k: sizes[k])
+            active_vendor = chosen_by_rows
+            body = candidates[chosen_by_rows]
+
+    if active_vendor is None:
+        return {"vendor": None, "hits": hits}
+
+    # 提取头部信息：表头字段都在首页，先在文档开头找，找不到才回退全文扫描
+    prof = VENDOR_PROFILES[active_vendor]
+    head = text[:_DETECT_PREFIX]
+    text_lower = None  # 惰性小写副本，只有触发全文回退时才构造一次
+
+    def _header(pattern, key=None):
+        nonlocal text_lower
+        if pattern is None:
+            return None
+        val = extract(pattern, head)
+        if val is None and len(text) > _DETECT_PREFIX:
+            # 字面量预筛：起始关键词不在全文里就跳过整个正则扫描
+            literal = prof["_header_literals"].get(key) if key else None
+            if literal is not None:
+                if text_lower is None:
+                    text_lower = text.lower()
+                if literal not in text_lower:
+                    return None
+            val = extract(pattern, text)
+        return val
+
+    date_key = "Delivery_Date" if "Delivery_Date" in prof["header_extract"] else "Order_Date"
+    sales_id = _header(prof["header_extract"].get("PO_Number"), "PO_Number")
+    order_date = _header(prof["header_extract"].get(date_key), date_key)
+    order_date = parse_date_safe(order_date)
+
+    # 提取并清理店铺名称
+    raw_name = _header(prof["store_regex"])
+    name_txt = clean_store_name(active_vendor, raw_name)
+
+    # 解析供应商数据（如果尚未完成）
+    error = None
+    if body is None:
+        try:
+            if active_vendor == "Foodstuffs_NI":
+                body = parse_foodstuffs(text)
+            elif active_vendor == "WWNZ":
+                body = parse_wwnz(text)
+            else:
+                body = parse_mfb(text)
+
+            body = validate_dataframe(body, active_vendor)
+        except Exception as e:
+            error = str(e)
+            body = None
+
+    return {
+        "vendor": active_vendor,
+        "hits": hits,
+        "body": body,
+        "sales_id": sales_id,
+        "order_date": order_date,
+        "name": name_txt,
+        "chosen_by_rows": chosen_by_rows,
+        "error": error,
+    }